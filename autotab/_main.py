@@ -8,12 +8,18 @@ import math
 import types
 import shutil
 import inspect
+import functools
+import tempfile
 from typing import Union, Callable, Tuple
-from collections import OrderedDict, defaultdict
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from skopt import Optimizer
+from skopt.space import Space
+from joblib import Parallel, delayed, parallel_backend
 from SeqMetrics import RegressionMetrics, ClassificationMetrics
 from easy_mpl import dumbbell_plot, taylor_plot, circular_bar_plot, bar_chart
 
@@ -61,6 +67,14 @@ DL_MODELS = {
 
 SEP = os.sep
 
+# base estimators of skopt's Optimizer which are used when parent hpo
+# is run in parallel
+SKOPT_ESTIMATORS = {
+    "bayes": "GP",
+    "bayes_rf": "RF",
+    "random": "dummy",
+}
+
 DEFAULT_TRANSFORMATIONS = [
     "minmax", "center", "scale", "zscore", "box-cox", "yeo-johnson",
     "quantile", "robust", "log", "log2", "log10", "sqrt", "none",
@@ -85,16 +99,22 @@ METRIC_TYPES = {
     "med_seq_error": "min",
 }
 
+# (offset, sign) to convert value of a metric into val_score which is minimized
+VAL_SCORE_TRANSFORMS = {
+    "min": (0.0, 1.0),
+    "max": (1.0, -1.0),
+}
+
 def compare_func(metric_type:str):
     if metric_type == "min":
         return np.less_equal
     return np.greater_equal
 
 
-def compare_func1(metric_type:str):
-    if metric_type == "min":
-        return np.nanmin
-    return np.nanmax
+def calc_metrics(errors, metrics:list)->dict:
+    """calculates the given performance metrics from a single instance of
+    Metrics class so that the true and predicted arrays are cleaned only once"""
+    return {m: getattr(errors, m)(**METRICS_KWARGS.get(m, {})) for m in metrics}
 
 
 def fill_val(metric_type:str, best_so_far):
@@ -105,6 +125,16 @@ def fill_val(metric_type:str, best_so_far):
     return -9999999999
 
 
+def _resolve_n_jobs(n_jobs:int, name:str = "n_jobs") -> int:
+    """converts n_jobs into a positive number of workers. Negative values
+    are interpreted as in joblib i.e. -1 means all the cpus, -2 all but one."""
+    if isinstance(n_jobs, bool) or not isinstance(n_jobs, (int, np.integer)) or n_jobs == 0:
+        raise ValueError(f"{name} must be a positive or negative integer but it is {n_jobs}")
+    if n_jobs < 0:
+        n_jobs = max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return int(n_jobs)
+
+
 class PipelineMixin(object):
 
     def __init__(
@@ -153,15 +183,20 @@ class OptimizePipeline(PipelineMixin):
         of evaluation metric at each parent iteration.
 
     - parent_suggestions_:
-        an ordered dictionary of suggestions to the parent objective function
+        a dictionary of suggestions to the parent objective function
         during parent hpo loop
 
     - child_val_scores_:
-        a numpy array of shape (parent_iterations, child_iterations) containing
-        value of eval_metric at all child hpo loops
+        a float32 numpy array of shape (parent_iterations, child_iterations)
+        containing value of eval_metric at all child hpo loops. It is
+        memory mapped to ``child_val_scores.npy`` file in path.
 
     - optimizer_
-        an instance of ai4water.hyperopt.HyperOpt [1]_ for parent optimization
+        an instance of ai4water.hyperopt.HyperOpt [1]_ for parent optimization.
+        If ``n_jobs`` is greater than 1, it is an instance of skopt's Optimizer
+        instead, which does not have the plotting methods of HyperOpt such as
+        ``_plot_convergence``. Its result can be plotted with
+        ``skopt.plots`` e.g. ``plot_convergence(pl.optimizer_.get_result())``.
 
     - models
         a list of models being considered for optimization
@@ -208,6 +243,9 @@ class OptimizePipeline(PipelineMixin):
             num_classes:int = None,
             category:str = "ML",
             prefix: str = None,
+            n_jobs: int = 1,
+            child_patience: int = None,
+            child_n_jobs: int = 1,
             **model_kwargs
     ):
         """
@@ -279,7 +317,10 @@ class OptimizePipeline(PipelineMixin):
             parent_algorithm : str, optional
                 Algorithm for optimization of parent optimzation
             child_algorithm : str, optional
-                Algorithm for optimization of child optimization
+                Algorithm for optimization of child optimization. If ``bayes``,
+                random search is used for models with small parameter space or
+                with less than 20 child iterations. This can be changed using
+                :meth: `change_child_algorithm` method.
             eval_metric : str, optional
                 Validation metric to calculate val_score in objective function.
                 The parent and child hpo loop optimizes/improves this metric. This metric is
@@ -305,6 +346,29 @@ class OptimizePipeline(PipelineMixin):
                 number of classes, only relevant if mode=="classification".
             category : str, optional (detault="DL")
                 either "DL" or "ML". If DL, the pipeline is optimized for neural networks.
+            n_jobs : int, optional (default=1)
+                number of parent iterations to evaluate in parallel. If greater than 1,
+                the parent hpo loop is run using ask/tell interface of skopt's
+                Optimizer and at each step ``n_jobs`` suggestions are evaluated in
+                separate processes using joblib. Only ``bayes``, ``bayes_rf`` and
+                ``random`` are supported as ``parent_algorithm`` in such a case.
+                Negative values are interpreted as in joblib e.g. -1 means
+                all the cpus. The baseline models of machine learning category are also fitted
+                in parallel. Since parent iterations run in separate processes, the
+                child hpo of a model is not warm started with its results from previous
+                parent iterations and ``previous_results`` can not be given to ``fit``.
+            child_patience : int, optional (default=None)
+                If given, the child hpo loop is stopped if the val_score does not
+                improve for these many consecutive child iterations. In such a case
+                the best hyperparameters found until then are used.
+            child_n_jobs : int, optional (default=1)
+                number of child iterations to evaluate in parallel. It is only
+                used for machine learning models whose child hpo algorithm is
+                ``random``, ``bayes`` or ``bayes_rf``. For ``random``, all the child
+                iterations are sampled at once, otherwise ``child_n_jobs``
+                iterations are suggested at each step. ``child_patience``
+                is checked only after all the iterations of a step are complete.
+                Negative values are interpreted in the same way as for ``n_jobs``.
             **model_kwargs :
                 any additional key word arguments for ai4water's Model
 
@@ -366,15 +430,35 @@ class OptimizePipeline(PipelineMixin):
         self.child_iterations = child_iterations
         # for internal use, we keep child_iter for each model
         self._child_iters = {model: child_iterations for model in self.models}
+        # child algorithms set by the user for specific models
+        self._child_algos = {}
+        # best pipeline for each (model_name, metric_name) pair
+        self._best_pipelines = {}
+        # iteration of best value of each metric, updated at every parent iteration
+        self._best_iters = {}
+        # parent iterations at which each model was used
+        self._model_iters = defaultdict(list)
+        self._num_indexed_iters = 0
         self.parent_algorithm = parent_algorithm
         self.child_algorithm = child_algorithm
 
+        n_jobs = _resolve_n_jobs(n_jobs)
+        if n_jobs != 1 and parent_algorithm not in SKOPT_ESTIMATORS:
+            raise ValueError(f"""
+            parent_algorithm {parent_algorithm} can not be used with n_jobs={n_jobs}.
+            Allowed values are {list(SKOPT_ESTIMATORS.keys())}""")
+        self.n_jobs = n_jobs
+        self.child_patience = child_patience
+        self.child_n_jobs = _resolve_n_jobs(child_n_jobs, "child_n_jobs")
+
         if eval_metric is None:
             if self.mode == "regression":
                 eval_metric = "mse"
             else:
                 eval_metric = "accuracy"
         self.eval_metric = eval_metric
+        # (offset, sign) to convert eval_metric into val_score
+        self._val_score_transform = VAL_SCORE_TRANSFORMS[METRIC_TYPES.get(eval_metric, 'min')]
         self.cv_parent_hpo = cv_parent_hpo
         self.cv_child_hpo = cv_child_hpo
 
@@ -421,12 +505,18 @@ class OptimizePipeline(PipelineMixin):
 
         self._optimize_model = True
         self._model = None
+        # parent space along with the arguments from which it was made
+        self._space_cache = (None, None)
 
         if self.outputs_to_transform is None:
             self._features_to_transform = self.inputs_to_transform
         else:
             self._features_to_transform = self.inputs_to_transform + self.outputs_to_transform
 
+        # sets for fast membership checks inside parent objective
+        self._features_to_transform_set = frozenset(self._features_to_transform)
+        self._inputs_to_transform_set = frozenset(self.inputs_to_transform)
+
         self.batch_space = []
         self.lr_space = []
         if category == "DL":
@@ -443,16 +533,23 @@ class OptimizePipeline(PipelineMixin):
             if isinstance(x, str):
                 x = [x]
             assert isinstance(x, list)
-            for i in x:
-                assert i in self.output_features
+            missing = set(x).difference(self.output_features)
+            assert not missing, f"{missing} are not in output_features"
         self._out_to_transform = x
 
     def maybe_make_path(self):
         _path = os.path.join(os.getcwd(), "results", self.parent_prefix_)
-        if not os.path.exists(_path):
-            os.makedirs(_path)
+        os.makedirs(_path, exist_ok=True)
         return _path
 
+    @property
+    def metrics_(self) -> pd.DataFrame:
+        return pd.DataFrame(self._metrics_arr, columns=self.monitor)
+
+    @property
+    def metrics_best_(self) -> pd.DataFrame:
+        return pd.DataFrame(self._metrics_best_arr, columns=self.monitor)
+
     @property
     def mode(self):
         return self._mode
@@ -518,8 +615,7 @@ class OptimizePipeline(PipelineMixin):
         for model, space in space.items():
             if model not in self.model_space:
                 raise ValueError(f"{model} is not valid because it is not being considered.")
-            space = to_skopt_space(space)
-            self.model_space[model] = {'param_space': [s for s in space]}
+            self.model_space[model] = {'param_space': list(to_skopt_space(space))}
         return
 
     def add_dl_model(
@@ -543,7 +639,7 @@ class OptimizePipeline(PipelineMixin):
             assert 'layers' in model_config, f"model config must have 'layers' key {model_config.keys()}"
 
             model_name = model.__name__
-            space = to_skopt_space(space)
+            space = list(to_skopt_space(space))
             self.models.append(model_name)
             DL_MODELS[model_name] = model
             self.model_space[model_name] = {'param_space': space}
@@ -577,8 +673,7 @@ class OptimizePipeline(PipelineMixin):
             assert model_name not in self.models, msg.format(model_name)
             assert model_name not in self._child_iters, msg.format(model_name)
 
-            model_space = to_skopt_space(model_space)
-            self.model_space[model_name] = {'param_space': model_space}
+            self.model_space[model_name] = {'param_space': list(to_skopt_space(model_space))}
             self.models.append(model_name)
             self._child_iters[model_name] = self.child_iterations
 
@@ -610,6 +705,7 @@ class OptimizePipeline(PipelineMixin):
             self.models.remove(model)
             self.model_space.pop(model)
             self._child_iters.pop(model)
+            self._child_algos.pop(model, None)
 
         return
 
@@ -641,9 +737,54 @@ class OptimizePipeline(PipelineMixin):
             self._child_iters[_model] = _iter
         return
 
+    def change_child_algorithm(self, model: dict):
+        """
+        changes the algorithm of child hpo for one or more models. By default,
+        if ``child_algorithm`` is ``bayes``, random search is used for those models
+        whose parameter space has 3 or less parameters or whose child iterations
+        are less than 20. For such cases the cost of fitting the surrogate model
+        is larger than the cost of fitting the model itself. This method can be
+        used to override this behaviour.
+
+        Parameters
+        ----------
+            model : dict
+                a dictionary whose keys are names of models and values are
+                names of algorithm for child hpo of that model
+        Example
+        -------
+            >>> pl = OptimizePipeline(...)
+            >>> pl.change_child_algorithm({"LinearRegression": "bayes"})
+        """
+        for _model, _algo in model.items():
+            if _model not in self._child_iters:
+                raise ValueError(f"{_model} is not a valid model name")
+            self._child_algos[_model] = _algo
+        return
+
+    def _child_algorithm(self, model: str) -> str:
+        """returns the algorithm to be used for child hpo of the model"""
+        if model in self._child_algos:
+            return self._child_algos[model]
+
+        if self.child_algorithm == "bayes":
+            # random search is as good as bayesian for small spaces/budgets
+            # and does not require fitting a surrogate at each iteration
+            child_space = self.model_space[model]['param_space'] + self.batch_space + self.lr_space
+            if len(child_space) <= 3 or self._child_iters[model] < 20:
+                return "random"
+
+        return self.child_algorithm
+
     def space(self) -> list:
         """makes the parameter space for parent hpo"""
 
+        # the space is made again only if models or transformations have changed
+        key = repr((self.models, self.inputs_to_transform, self.input_transformations,
+                    self.outputs_to_transform, self.output_transformations))
+        if self._space_cache[0] == key:
+            return list(self._space_cache[1])
+
         append = {}
         y_categories = []
 
@@ -664,7 +805,7 @@ class OptimizePipeline(PipelineMixin):
             # on feature transformation is to be applied
 
             if isinstance(self.output_transformations, list):
-                assert all([t in DEFAULT_TRANSFORMATIONS for t in self.output_transformations]), f"""
+                assert set(self.output_transformations).issubset(DEFAULT_TRANSFORMATIONS), f"""
                 transformations must be one of {DEFAULT_TRANSFORMATIONS}"""
 
                 for out in self.output_features:
@@ -677,14 +818,13 @@ class OptimizePipeline(PipelineMixin):
 
                     assert out_feature in self.output_features
                     assert isinstance(y_transformations, list)
-                    assert all(
-                        [t in DEFAULT_TRANSFORMATIONS for t in self.output_transformations]), f"""
+                    assert set(y_transformations).issubset(DEFAULT_TRANSFORMATIONS), f"""
                         transformations must be one of {DEFAULT_TRANSFORMATIONS}"""
                     append[out_feature] = y_transformations
-                y_categories = list(self.output_transformations.values())
+                    y_categories = y_categories + y_transformations
 
         sp = make_space(self.inputs_to_transform + (self.outputs_to_transform or []),
-                        categories=list(set(x_categories + y_categories)),
+                        categories=list(set(x_categories).union(y_categories)),
                         append=append)
 
         if len(self.models)>1:
@@ -694,7 +834,9 @@ class OptimizePipeline(PipelineMixin):
             self._optimize_model = False
             self._model = self.models[0]
 
-        return sp
+        self._space_cache = (key, sp)
+
+        return list(sp)
 
     def change_batch_size_space(self, space:list, low=None, high=None):
         """changes the value of class attribute ``batch_space``.
@@ -731,28 +873,35 @@ class OptimizePipeline(PipelineMixin):
         self.parent_prefix_ = f"pipeline_opt_{dateandtime_now()}"
         self.path = self.maybe_make_path()
 
-        self.metrics_ = pd.DataFrame(
-            np.full((self.parent_iterations, len(self.monitor)), np.nan),
-            columns=self.monitor
-        )
+        # values of monitored metrics at each parent iteration
+        self._metrics_arr = {m: np.full(self.parent_iterations, np.nan) for m in self.monitor}
 
         self.parent_iter_ = 0
         self.child_iter_ = 0
         self.val_scores_ = np.full(self.parent_iterations, np.nan)
 
-        metrics_best = np.full((self.parent_iterations, len(self.monitor)), np.nan)
-        self.metrics_best_ = pd.DataFrame(metrics_best, columns=self.monitor)
+        # values of monitored metrics at those iterations where they improved
+        self._metrics_best_arr = {m: np.full(self.parent_iterations, np.nan) for m in self.monitor}
+        # best value of each monitored metric so far
+        self._best_so_far = {m: np.nan for m in self.monitor}
 
         self.parent_seeds_ = np.random.randint(0, 10000, self.parent_iterations)
         self.child_seeds_ = np.random.randint(0, 10000, self.max_child_iters)
 
         # each row indicates parent iteration, column indicates child iteration
-        self.child_val_scores_ = np.full((self.parent_iterations,
-                                          self.max_child_iters),
-                                         np.nan)
+        shape = (self.parent_iterations, self.max_child_iters)
+        if self.max_child_iters > 0:
+            # backed by a .npy file in path, so that child val scores
+            # of completed parent iterations are not lost if fit crashes
+            self.child_val_scores_ = np.lib.format.open_memmap(
+                os.path.join(self.path, "child_val_scores.npy"),
+                mode="w+", dtype=np.float32, shape=shape)
+            self.child_val_scores_[:] = np.nan
+        else:
+            self.child_val_scores_ = np.full(shape, np.nan, dtype=np.float32)
         self.start_time_ = time.asctime()
 
-        self.parent_suggestions_ = OrderedDict()
+        self.parent_suggestions_ = {}
 
         # create container to store data for Taylor plot
         # It will be populated during postprocessing
@@ -763,6 +912,19 @@ class OptimizePipeline(PipelineMixin):
 
         self.baseline_results_ = None
 
+        # results of already evaluated parent suggestions
+        self._parent_cache_ = {}
+
+        self._best_pipelines = {}
+        self._best_iters = {}
+        # child iterations of each model from previous parent iterations
+        self._child_history = {}
+        self._model_iters = defaultdict(list)
+        self._num_indexed_iters = 0
+
+        # format of the line printed at each parent iteration
+        self._row_fmt_ = "{:<5} {:<18.3} " + "{:<15.7} " * (len(self.monitor))
+
         self._save_config()  # will also make path if it does not already exists
 
         self._print_header()
@@ -805,33 +967,47 @@ class OptimizePipeline(PipelineMixin):
                 validation data on which pipeline is optimized. Only required if ``data``
                 is not given.
             previous_results : dict, optional
-                path of file which contains xy values.
+                path of file which contains xy values. Not supported when
+                ``n_jobs`` is greater than 1, in which case a ValueError is raised.
             process_results : bool
+                Ignored when ``n_jobs`` is greater than 1.
 
         Returns
         --------
-            an instance of ai4water.hyperopt.HyperOpt class which is used for
-            optimization.
+            the result of ai4water.hyperopt.HyperOpt class which is used for
+            optimization. If ``n_jobs`` is greater than 1, the result of
+            skopt's Optimizer is returned.
         """
 
+        if previous_results is not None and self.n_jobs != 1:
+            raise ValueError(f"previous_results can not be used with n_jobs={self.n_jobs}")
+
         self.data_, self.val_data_ = verify_data(x, y, data, validation_data)
 
         self.reset()
 
-        parent_opt = HyperOpt(
-            self.parent_algorithm,
-            param_space=self.space(),
-            objective_fn=self.parent_objective,
-            num_iterations=self.parent_iterations,
-            opt_path=self.path,
-            verbosity = 0,
-            process_results=process_results,
-        )
+        # the space depends upon models and transformations which can not
+        # change during optimization, so it is made only once
+        space = self.space()
+
+        if self.n_jobs == 1:
+            parent_opt = HyperOpt(
+                self.parent_algorithm,
+                param_space=space,
+                objective_fn=self.parent_objective,
+                num_iterations=self.parent_iterations,
+                opt_path=self.path,
+                verbosity = 0,
+                process_results=process_results,
+            )
 
-        if previous_results is not None:
-            parent_opt.add_previous_results(previous_results)
+            if previous_results is not None:
+                parent_opt.add_previous_results(previous_results)
 
-        res = parent_opt.fit()
+            res = parent_opt.fit()
+        else:
+            parent_opt = self._parallel_fit(space)
+            res = parent_opt.get_result()
 
         setattr(self, 'optimizer_', parent_opt)
 
@@ -843,6 +1019,77 @@ class OptimizePipeline(PipelineMixin):
 
         return res
 
+    def _parallel_fit(self, space: list) -> Optimizer:
+        """runs the parent hpo loop by evaluating ``n_jobs`` suggestions at each
+        step. The suggestions are obtained from skopt's Optimizer using its
+        ask/tell interface. When more than one points are asked, skopt uses
+        constant liar strategy so that the suggestions in a batch are different.
+        """
+        names = [dim.name for dim in space]
+
+        optimizer = Optimizer(
+            space,
+            base_estimator=SKOPT_ESTIMATORS[self.parent_algorithm],
+            n_initial_points=min(10, self.parent_iterations),
+            random_state=int(self.parent_seeds_[0]),
+            # fewer candidates and restarts for optimizing the acquisition function
+            # since the surrogate is refitted after every batch
+            acq_optimizer_kwargs={"n_points": 1000, "n_restarts_optimizer": 1},
+        )
+
+        # the models can themselves use n_jobs=-1, so limit the threads in
+        # each worker to avoid oversubscription. The workers are reused for all
+        # batches and arrays larger than max_nbytes e.g. training data are
+        # memory mapped (copy on write) instead of being pickled for every task
+        with parallel_backend("loky", inner_max_num_threads=1), \
+                Parallel(n_jobs=self.n_jobs, max_nbytes="1M", mmap_mode="c") as parallel:
+            self._parallel_loop(optimizer, names, parallel)
+
+        return optimizer
+
+    def _parallel_loop(self, optimizer: Optimizer, names: list, parallel: Parallel):
+        """asks ``n_jobs`` suggestions from optimizer, evaluates them using
+        ``parallel`` and tells the results back until parent_iterations are complete."""
+        # random suggestions do not depend upon previous results, so all of
+        # them are asked at once and workers don't wait for each other between batches
+        batch_size = self.parent_iterations if self.parent_algorithm == "random" else self.n_jobs
+
+        while self.parent_iter_ < self.parent_iterations:
+
+            n_points = min(batch_size, self.parent_iterations - self.parent_iter_)
+            xs = optimizer.ask(n_points=n_points)
+
+            suggestions = [dict(zip(names, x)) for x in xs]
+            keys = [tuple(sorted(suggestion.items())) for suggestion in suggestions]
+
+            # only those suggestions are evaluated which have not been evaluated before
+            to_eval = {}
+            for idx, (key, suggestion) in enumerate(zip(keys, suggestions)):
+                if key not in self._parent_cache_ and key not in to_eval:
+                    to_eval[key] = (suggestion, self.parent_iter_ + idx)
+
+            if to_eval:
+                results = parallel(
+                    delayed(self._eval_point)(suggestion, iter_num)
+                    for suggestion, iter_num in to_eval.values()
+                )
+                self._parent_cache_.update(zip(to_eval.keys(), results))
+
+            # bookkeeping is done only in main process and in the order
+            # in which the suggestions were asked
+            ys = []
+            for key in keys:
+                if key in to_eval:
+                    self._record_point(*self._parent_cache_[key])
+                    to_eval.pop(key)
+                else:
+                    self._record_cached_point(key)
+                ys.append(self._parent_cache_[key][0])
+
+            optimizer.tell(xs, ys)
+
+        return
+
     def parent_objective(
             self,
             **suggestions
@@ -860,8 +1107,37 @@ class OptimizePipeline(PipelineMixin):
                 input feature and the model to use
         """
 
-        self.CHILD_PREFIX = f"{self.parent_iter_}_{dateandtime_now()}"
-        # self.seed = np.random.randint(0, 10000, 1).item()
+        key = tuple(sorted(suggestions.items()))
+
+        if key in self._parent_cache_:
+            # this pipeline has already been evaluated
+            self._record_cached_point(key)
+        else:
+            self._parent_cache_[key] = self._eval_point(suggestions, self.parent_iter_)
+            self._record_point(*self._parent_cache_[key])
+
+        return self._parent_cache_[key][0]
+
+    def _eval_point(
+            self,
+            suggestions: dict,
+            iter_num: int
+    ) -> Tuple[float, dict, dict, list]:
+        """
+        builds, optimizes and evaluates the pipeline for one parent iteration.
+        This method does not modify the bookkeeping attributes of the class
+        so that it can be run in a separate process.
+
+        Returns
+        -------
+        tuple
+            a tuple of length 4
+                - val_score
+                - a dictionary of values of metrics being monitored
+                - a dictionary of pipeline i.e. the parent suggestion
+                - a list of val_scores during child hpo loop
+        """
+        child_prefix = f"{iter_num}_{dateandtime_now()}"
 
         if self._optimize_model:
             model = suggestions['model']
@@ -870,12 +1146,16 @@ class OptimizePipeline(PipelineMixin):
 
         x_trnas, y_trans = self._cook_transformations(suggestions)
 
+        child_scores = []
         if self._child_iters[model]>0:
             # optimize the hyperparas of model using child objective
             opt_paras = self.optimize_model_paras(
                 model,
                 x_transformations=x_trnas,
-                y_transformations=y_trans or None
+                y_transformations=y_trans or None,
+                child_prefix=child_prefix,
+                child_scores=child_scores,
+                parent_iter=iter_num,
             )
         else:
             opt_paras = {}
@@ -897,56 +1177,401 @@ class OptimizePipeline(PipelineMixin):
             val_metric=self.eval_metric,
             x_transformation=x_trnas,
             y_transformation=y_trans,
-            prefix=f"{self.parent_prefix_}{SEP}{self.CHILD_PREFIX}",
+            prefix=f"{self.parent_prefix_}{SEP}{child_prefix}",
             **kwargs
         )
 
         # set the global seed. This is only for internal use so that results become more reproducible
         # when the model is built again
-        _model.seed_everything(int(self.parent_seeds_[self.parent_iter_]))
+        _model.seed_everything(int(self.parent_seeds_[iter_num]))
 
-        self.parent_suggestions_[self.parent_iter_] = {
-            # 'seed': self.seed,
+        pipeline = {
             'x_transformation': x_trnas,
             'y_transformation': y_trans,
             'model': {model: opt_paras},
             'path': _model.path
         }
 
-        val_score = self._fit_and_eval(
+        val_score, metrics = self._fit_and_eval(
             model=_model,
             cross_validate=self.cv_parent_hpo,
             eval_metrics=True,
         )
 
+        return val_score, metrics, pipeline, child_scores
+
+    def _record_point(
+            self,
+            val_score: float,
+            metrics: dict,
+            pipeline: dict,
+            child_scores: list,
+            cached: bool = False,
+    ) -> None:
+        """saves the results of a parent iteration and prints them"""
+
+        self.parent_suggestions_[self.parent_iter_] = pipeline
+        # best pipelines must be found again
+        self._best_pipelines.clear()
+
         self.val_scores_[self.parent_iter_] = val_score  # -1 because array indexing starts from 0
 
+        for k, pm_val in metrics.items():
+
+            self._metrics_arr[k][self.parent_iter_] = pm_val
+
+            best_so_far = fill_val(METRIC_TYPES[k], self._best_so_far[k])
+
+            func = compare_func(METRIC_TYPES[k])
+            if func(pm_val, best_so_far):
+
+                # in case of a tie, the earlier iteration remains the best one
+                if pm_val != self._best_so_far[k]:
+                    self._best_iters[k] = self.parent_iter_
+
+                self._metrics_best_arr[k][self.parent_iter_] = pm_val
+                self._best_so_far[k] = pm_val
+
+        # populate all child val scores
+        self.child_val_scores_[self.parent_iter_, :len(child_scores)] = child_scores
+        self.child_iter_ = len(child_scores)
+
         _val_score = val_score if np.less_equal(val_score, np.nanmin(self.val_scores_[:self.parent_iter_+1 ])) else ''
 
         # print the merics being monitored
         # we fill the nan in metrics_best_ with '' so that it does not gen printed
-        formatter = "{:<5} {:<18.3} " + "{:<15.7} " * (len(self.monitor))
+        best_vals = [self._metrics_best_arr[m][self.parent_iter_] for m in self.monitor]
+        formatter = self._row_fmt_ + "(cached)" if cached else self._row_fmt_
         print(formatter.format(
             self.parent_iter_,
             _val_score,
-            *self.metrics_best_.loc[self.parent_iter_].fillna('').values.tolist())
+            *['' if np.isnan(val) else val for val in best_vals])
         )
 
         self.parent_iter_ += 1
 
-        return val_score
+        return
+
+    def _record_cached_point(self, key: tuple) -> None:
+        """records the results of an already evaluated pipeline for the
+        current parent iteration. The child hpo is not run again for it."""
+        val_score, metrics, pipeline, _ = self._parent_cache_[key]
+        # copy because get_best_pipeline_by_* methods modify the pipeline
+        self._record_point(val_score, metrics, dict(pipeline), [], cached=True)
+        return
 
     def optimize_model_paras(
             self,
             model: str,
             x_transformations: list,
-            y_transformations: list
+            y_transformations: list,
+            child_prefix: str = None,
+            child_scores: list = None,
+            parent_iter: int = None,
     ) -> dict:
-        """optimizes hyperparameters of a model"""
+        """optimizes hyperparameters of a model
+
+        Parameters
+        ----------
+            model : str
+                name of model whose hyperparameters are to be optimized
+            x_transformations : list
+                transformations to be applied on inputs
+            y_transformations : list
+                transformations to be applied on outputs
+            child_prefix : str, optional
+                name of folder inside path where child models are saved
+            child_scores : list, optional
+                If given, val_score of each child iteration is appended to it.
+            parent_iter : int, optional
+                the parent iteration for which the model is optimized. It is
+                used to sample different child iterations for each parent
+                iteration. If not given, ``parent_iter_`` is used.
+        """
+        if parent_iter is None:
+            parent_iter = self.parent_iter_
+
+        if child_prefix is None:
+            child_prefix = f"{parent_iter}_{dateandtime_now()}"
+
+        if child_scores is None:
+            child_scores = []
+
+        prefix = f"{self.parent_prefix_}{SEP}{child_prefix}"
+
+        # make space
+        child_space = self.model_space[model]['param_space'] + self.batch_space + self.lr_space
+
+        if self._child_iters[model] == 1:
+            # there is nothing to optimize, so the only child iteration
+            # is evaluated without making an optimizer
+            return self._single_child_iteration(
+                model, child_space, x_transformations, y_transformations,
+                prefix, child_scores, random_state=self._child_random_state(parent_iter))
+
+        # DL models may have been added by the user with add_dl_model and
+        # can not be found by the worker processes
+        if self.child_n_jobs != 1 and self.category == "ML" and self._child_algorithm(model) in SKOPT_ESTIMATORS:
+            return self._parallel_child_search(
+                model, child_space, x_transformations, y_transformations,
+                prefix, child_scores, random_state=self._child_random_state(parent_iter))
+
+        # best child iteration so far, used for early stopping
+        best = {'val_score': np.inf, 'paras': None, 'stale_iters': 0}
+
+        # For ML models, the Model built in first child iteration is reused
+        # and only the parameters of its estimator are changed. Cross validation
+        # builds new models from config, so the Model is not reused then.
+        model_shell = {} if self.category == "ML" and not self.cv_child_hpo else None
+
+        # child iterations of this model evaluated during previous parent iterations
+        names = [dim.name for dim in child_space]
+        prev_dims, xs, ys = self._child_history.get(model, (None, [], []))
+        if prev_dims != tuple(child_space):
+            xs, ys = [], []
+        num_prev = len(xs)
+
+        # val_scores of already evaluated suggestions during this child hpo
+        evaluated = {}
 
         def child_objective(lr=0.001, batch_size=32, **suggestions):
             """objective function for optimization of model parameters"""
 
+            all_paras = {'lr': lr, 'batch_size': batch_size, **suggestions}
+            key = tuple(sorted(all_paras.items()))
+
+            if key in evaluated:
+                # the optimizer suggested the same parameters again
+                val_score = evaluated[key]
+            else:
+                val_score = self._child_val_score(
+                    model,
+                    suggestions,
+                    lr=lr,
+                    batch_size=batch_size,
+                    x_transformations=x_transformations,
+                    y_transformations=y_transformations,
+                    prefix=prefix,
+                    seed=self.child_seeds_[len(child_scores)],
+                    model_shell=model_shell,
+                )
+                evaluated[key] = val_score
+
+            child_scores.append(val_score)
+
+            xs.append([all_paras[name] for name in names])
+            ys.append(val_score)
+
+            if len(child_scores) % 10 == 0:
+                gc.collect()
+
+            paras = dict(suggestions)
+            if self.category == "DL":
+                paras.update({'lr': lr, 'batch_size': batch_size})
+
+            if val_score < best['val_score']:
+                best.update({'val_score': val_score, 'paras': paras, 'stale_iters': 0})
+            else:
+                best['stale_iters'] += 1
+                if best['paras'] is None:
+                    # val_score is nan or inf, so the first suggestion
+                    # is used unless a later one is better
+                    best['paras'] = paras
+
+            if self.child_patience and best['stale_iters'] >= self.child_patience:
+                raise ChildEarlyStop
+
+            return val_score
+
+        # only best paras are required from child hpo, so results of
+        # optimizer are saved in a temporary folder which is deleted afterwards
+        opt_path = tempfile.mkdtemp(prefix=f"{child_prefix}_", dir=self.path)
+
+        optimizer = HyperOpt(
+            self._child_algorithm(model),
+            objective_fn=child_objective,
+            num_iterations=self._child_iters[model],
+            param_space=child_space,
+            verbosity=0,
+            process_results=False,
+            opt_path=opt_path,
+        )
+
+        # the surrogate model of bayesian optimization is warm started with
+        # results of this model from previous parent iterations. With n_jobs>1
+        # this history stays in the worker processes and is not shared.
+        if num_prev > 0 and self._child_algorithm(model) in ("bayes", "bayes_rf"):
+            optimizer.add_previous_results(x=xs[:num_prev], y=ys[:num_prev])
+
+        try:
+            optimizer.fit()
+        except ChildEarlyStop:
+            # the optimizer was stopped, so best parameters found so far are used
+            pass
+        finally:
+            shutil.rmtree(opt_path, ignore_errors=True)
+            # only the most recent ones are kept so that fitting
+            # the surrogate model does not get too expensive
+            self._child_history[model] = (tuple(child_space), xs[-50:], ys[-50:])
+
+        # the best parameters are taken from the current child iterations and
+        # not from the optimizer which also knows the previous results
+        best_paras = best['paras']
+
+        # free memory if possible. The objects created during child hpo are in
+        # younger generations, so a full collection is done only now and then.
+        del optimizer, child_objective
+        gc.collect(generation=2 if self.parent_iter_ % 25 == 0 else 1)
+
+        # return the optimized parameters
+        return best_paras
+
+    def _single_child_iteration(
+            self,
+            model: str,
+            child_space: list,
+            x_transformations: list,
+            y_transformations: list,
+            prefix: str,
+            child_scores: list,
+            random_state: int,
+    ) -> dict:
+        """evaluates one random sample from child_space and returns it."""
+        names = [dim.name for dim in child_space]
+        point = Space(child_space).rvs(n_samples=1, random_state=random_state)[0]
+        suggestions = dict(zip(names, point))
+
+        lr = suggestions.pop('lr', 0.001)
+        batch_size = suggestions.pop('batch_size', 32)
+
+        child_scores.append(self._child_val_score(
+            model,
+            suggestions,
+            lr=lr,
+            batch_size=batch_size,
+            x_transformations=x_transformations,
+            y_transformations=y_transformations,
+            prefix=prefix,
+            seed=self.child_seeds_[0]
+        ))
+
+        if self.category == "DL":
+            suggestions.update({'lr': lr, 'batch_size': batch_size})
+
+        return suggestions
+
+    def _child_random_state(self, parent_iter: int) -> int:
+        """random state for sampling the child iterations of a parent iteration,
+        so that each parent iteration gets different child iterations"""
+        return int(self.child_seeds_[0]) + int(parent_iter)
+
+    def _parallel_child_search(
+            self,
+            model: str,
+            child_space: list,
+            x_transformations: list,
+            y_transformations: list,
+            prefix: str,
+            child_scores: list,
+            random_state: int,
+    ) -> dict:
+        """evaluates the child iterations of a machine learning model in
+        ``child_n_jobs`` separate processes using ask/tell interface of skopt's
+        Optimizer. For random search, all the child iterations are asked at once,
+        otherwise ``child_n_jobs`` iterations are asked at each step.
+        Returns the best parameters."""
+        algorithm = self._child_algorithm(model)
+        num_iters = self._child_iters[model]
+        names = [dim.name for dim in child_space]
+
+        optimizer = Optimizer(
+            child_space,
+            base_estimator=SKOPT_ESTIMATORS[algorithm],
+            n_initial_points=min(10, num_iters),
+            random_state=random_state,
+            acq_optimizer_kwargs={"n_points": 1000, "n_restarts_optimizer": 1},
+        )
+
+        # the surrogate model is warm started with results of
+        # this model from previous parent iterations
+        prev_dims, xs, ys = self._child_history.get(model, (None, [], []))
+        if prev_dims != tuple(child_space):
+            xs, ys = [], []
+        if xs and algorithm != "random":
+            optimizer.tell(list(xs), list(ys))
+
+        batch_size = num_iters if algorithm == "random" else self.child_n_jobs
+
+        best = {'val_score': np.inf, 'paras': None, 'stale_iters': 0}
+
+        with parallel_backend("loky", inner_max_num_threads=1), \
+                Parallel(n_jobs=self.child_n_jobs) as parallel:
+
+            while len(child_scores) < num_iters:
+
+                points = optimizer.ask(n_points=min(batch_size, num_iters - len(child_scores)))
+                suggestions = [dict(zip(names, point)) for point in points]
+
+                scores = parallel(
+                    delayed(self._child_val_score)(
+                        model,
+                        suggestion,
+                        lr=0.001,
+                        batch_size=32,
+                        x_transformations=x_transformations,
+                        y_transformations=y_transformations,
+                        # ai4water names the folder of a Model by the time up to
+                        # seconds, so models built at the same time in different
+                        # workers must have different prefixes
+                        prefix=f"{prefix}{SEP}child_{len(child_scores) + idx}",
+                        seed=self.child_seeds_[len(child_scores) + idx]
+                    ) for idx, suggestion in enumerate(suggestions)
+                )
+
+                optimizer.tell(points, scores)
+                child_scores.extend(scores)
+                xs.extend(points)
+                ys.extend(scores)
+
+                for suggestion, val_score in zip(suggestions, scores):
+                    if val_score < best['val_score']:
+                        best.update({'val_score': val_score, 'paras': suggestion, 'stale_iters': 0})
+                    else:
+                        best['stale_iters'] += 1
+                        if best['paras'] is None:
+                            # val_score is nan or inf, so the first suggestion
+                            # is used unless a later one is better
+                            best['paras'] = suggestion
+
+                # patience is checked only after a batch is complete
+                if self.child_patience and best['stale_iters'] >= self.child_patience:
+                    break
+
+        self._child_history[model] = (tuple(child_space), xs[-50:], ys[-50:])
+
+        return best['paras']
+
+    def _child_val_score(
+            self,
+            model: str,
+            suggestions: dict,
+            lr: float,
+            batch_size: int,
+            x_transformations: list,
+            y_transformations: list,
+            prefix: str,
+            seed: int,
+            model_shell: dict = None,
+    ) -> float:
+        """builds and evaluates a child model with given suggestions and returns
+        its val_score. If ``model_shell`` is given, the Model stored in it
+        is reused by setting the parameters of its estimator, provided the same
+        parameters are suggested. A newly built Model is stored in it if its
+        estimator can be reused (see ``_is_reusable``)."""
+        if model_shell and model_shell['paras'] == frozenset(suggestions):
+            _model = model_shell['model']
+            _model._model.set_params(**suggestions)
+        else:
             if self.category == "DL":
                 model_config = DL_MODELS[model](mode=self.mode,
                                                 output_features=self.num_outputs,
@@ -960,46 +1585,31 @@ class OptimizePipeline(PipelineMixin):
                 val_metric=self.eval_metric,
                 x_transformation=x_transformations,
                 y_transformation=y_transformations,
-                prefix=f"{self.parent_prefix_}{SEP}{self.CHILD_PREFIX}",
+                prefix=prefix,
                 lr=float(lr),
                 batch_size=int(batch_size)
             )
 
-            _model.seed_everything(int(self.child_seeds_[self.child_iter_]))
-
-            val_score = self._fit_and_eval(
-                model=_model,
-                cross_validate=self.cv_child_hpo)
-
-            # populate all child val scores
-            self.child_val_scores_[self.parent_iter_-1, self.child_iter_] = val_score
-
-            self.child_iter_ += 1
-
-            return val_score
-
-        # make space
-        child_space = self.model_space[model]['param_space'] + self.batch_space + self.lr_space
+            if model_shell is not None and _is_reusable(getattr(_model, '_model', None), suggestions):
+                model_shell.update({'model': _model, 'paras': frozenset(suggestions)})
 
-        self.child_iter_ = 0  # before starting child hpo, reset iteration counter
+        _model.seed_everything(int(seed))
 
-        optimizer = HyperOpt(
-            self.child_algorithm,
-            objective_fn=child_objective,
-            num_iterations=self._child_iters[model],
-            param_space=child_space,
-            verbosity=0,
-            process_results=False,
-            opt_path=os.path.join(self.path, self.CHILD_PREFIX),
-        )
+        val_score, _ = self._fit_and_eval(
+            model=_model,
+            cross_validate=self.cv_child_hpo)
 
-        optimizer.fit()
+        # the Model holds the fitted estimator and its data, so
+        # release it before the next child iteration builds another one
+        del _model
 
-        # free memory if possible
-        gc.collect()
+        if self.category == "DL":
+            # otherwise the graphs of all child models stay in memory
+            from ai4water.backend import tf
+            if tf is not None:
+                tf.keras.backend.clear_session()
 
-        # return the optimized parameters
-        return optimizer.best_paras()
+        return val_score
 
     def _cook_transformations(self, suggestions):
         """prepares the transformation keyword argument based upon
@@ -1011,18 +1621,18 @@ class OptimizePipeline(PipelineMixin):
 
         for feature, method in suggestions.items():
 
-            if feature in self._features_to_transform:
-                if method != "none":  # don't do anything with this feature
-                    # get the relevant transformation for this feature
-                    t_config = {"method": method, "features": self._groups[feature]}
+            # don't do anything with this feature if method is none
+            if method != "none" and feature in self._features_to_transform_set:
+                # get the relevant transformation for this feature
+                # some preprocessing is required for log based transformations
+                t_config = {"method": method,
+                            "features": self._groups[feature],
+                            **self.transformations[method]}
 
-                    # some preprocessing is required for log based transformations
-                    t_config.update(self.transformations[method])
-
-                    if feature in self.inputs_to_transform:
-                        x_transformations.append(t_config)
-                    else:
-                        y_transformations.append(t_config)
+                if feature in self._inputs_to_transform_set:
+                    x_transformations.append(t_config)
+                else:
+                    y_transformations.append(t_config)
 
         return x_transformations, y_transformations
 
@@ -1065,8 +1675,11 @@ class OptimizePipeline(PipelineMixin):
             model,
             cross_validate:bool = False,
             eval_metrics:bool = False,
-    ) -> float:
-        """fits the model and evaluates it and returns the score"""
+    ) -> Tuple[float, dict]:
+        """fits the model and evaluates it and returns the score and a dictionary
+        of performance metrics being monitored. The dictionary is empty if
+        eval_metrics is False."""
+        metrics = {}
         if cross_validate:
             # val_score will be obtained by performing cross validation
             if self.val_data_:  # keyword data
@@ -1083,30 +1696,19 @@ class OptimizePipeline(PipelineMixin):
 
             val_score = val_scores.pop(0)
 
-            for k, pm_val in zip(self.monitor, val_scores):
-
-                self.metrics_.at[self.parent_iter_, k] = pm_val
-
-                func = compare_func1(METRIC_TYPES[k])
-                best_so_far = func(self.metrics_best_.loc[:self.parent_iter_, k])
-
-                best_so_far = fill_val(METRIC_TYPES[k], best_so_far)
-
-                func = compare_func(METRIC_TYPES[k])
-                if func(pm_val, best_so_far):
-
-                    self.metrics_best_.at[self.parent_iter_, k] = pm_val
+            if eval_metrics:
+                metrics = dict(zip(self.monitor, val_scores))
         else:
             # train the model and evaluate it to calculate val_score
             model.fit(**self.data_)
-            val_score = self._eval_model_manually(
+            val_score, metrics = self._eval_model_manually(
                 model,
                 #data,
                 self.eval_metric,
                 eval_metrics=eval_metrics
             )
 
-        return val_score
+        return val_score, metrics
 
     def get_best_metric(
             self,
@@ -1126,13 +1728,9 @@ class OptimizePipeline(PipelineMixin):
         float
             the best value of performance metric acheived
         """
-        if metric_name not in self.monitor:
-            raise MetricNotMonitored(metric_name, self.monitor)
+        iter_num = self.get_best_metric_iteration(metric_name)
 
-        if METRIC_TYPES[metric_name] == "min":
-            return np.nanmin(self.metrics_[metric_name]).item()
-        else:
-            return np.nanmax(self.metrics_[metric_name]).item()
+        return self._metrics_arr[metric_name][iter_num].item()
 
     def get_best_metric_iteration(
             self,
@@ -1152,12 +1750,15 @@ class OptimizePipeline(PipelineMixin):
         if metric_name not in self.monitor:
             raise MetricNotMonitored(metric_name, self.monitor)
 
-        if METRIC_TYPES[metric_name] == "min":
-            idx = np.nanargmin(self.metrics_[metric_name].values)
-        else:
-            idx = np.nanargmax(self.metrics_[metric_name].values)
+        if metric_name not in self._best_iters:
+            if METRIC_TYPES[metric_name] == "min":
+                idx = np.nanargmin(self._metrics_arr[metric_name])
+            else:
+                idx = np.nanargmax(self._metrics_arr[metric_name])
+
+            self._best_iters[metric_name] = int(idx)
 
-        return int(idx)
+        return self._best_iters[metric_name]
 
     def get_best_pipeline_by_metric(
             self,
@@ -1234,31 +1835,46 @@ class OptimizePipeline(PipelineMixin):
         if metric_name not in self.monitor:
             raise MetricNotMonitored(metric_name, self.monitor)
 
-        # initialize an empty dictionary to store model parameters
-        model_container = {}
+        if (model_name, metric_name) in self._best_pipelines:
+            return self._best_pipelines[(model_name, metric_name)]
 
-        for iter_num, iter_suggestions in self.parent_suggestions_.items():
-            # iter_suggestion is a dictionary and it contains four keys
-            model = iter_suggestions['model']
+        iters = self._iterations_of_model(model_name)
 
-            # model is dictionary, whose key is the model_name and values
-            # are model configuration
+        if len(iters) == 0:
+            raise ModelNotUsedError(model_name)
 
-            if model_name in model:
-                # find out the metric value at iter_num
-                metric_val = self.metrics_.loc[int(iter_num), metric_name]
-                metric_val = round(metric_val, 4)
+        # values of metric at those iterations where the model was used
+        metric_vals = self._metrics_arr[metric_name][iters]
 
-                iter_suggestions['iter_num'] = iter_num
-                model_container[metric_val] = iter_suggestions
+        if METRIC_TYPES[metric_name] == "min":
+            idx = int(np.nanargmin(metric_vals))
+        else:
+            idx = int(np.nanargmax(metric_vals))
 
-        if len(model_container) == 0:
-            raise ModelNotUsedError(model_name)
+        iter_num = iters[idx]
+
+        # iter_suggestion is a dictionary and it contains four keys
+        pipeline = self.parent_suggestions_[iter_num]
+        pipeline['iter_num'] = iter_num
 
-        # sorting the container w.r.t given metric_name
-        sorted_container = sorted(model_container.items())
+        best = round(float(metric_vals[idx]), 4), pipeline
 
-        return sorted_container[-1]
+        self._best_pipelines[(model_name, metric_name)] = best
+
+        return best
+
+    def _iterations_of_model(self, model_name: str) -> list:
+        """returns the parent iterations at which the model was used. Only those
+        iterations are indexed which have not been indexed before."""
+        for iter_num in range(self._num_indexed_iters, len(self.parent_suggestions_)):
+            # model is dictionary, whose key is the model_name and values
+            # are model configuration
+            for model in self.parent_suggestions_[iter_num]['model']:
+                self._model_iters[model].append(iter_num)
+
+        self._num_indexed_iters = len(self.parent_suggestions_)
+
+        return self._model_iters.get(model_name, [])
 
     def baseline_results(
             self,
@@ -1312,39 +1928,23 @@ class OptimizePipeline(PipelineMixin):
             val_scores = {}
             metrics = {}
 
-            for model_name in self.models:
-
-                model_config = model_name
-                if self.category == "DL":
-                    model_config = DL_MODELS[model_name](mode=self.mode, output_features=self.num_outputs)
-
-                # build model
-                model = self._build_model(
-                    model=model_config,
-                    val_metric=self.eval_metric,
-                    prefix=f"{self.parent_prefix_}{SEP}baselines",
-                    x_transformation=None,
-                    y_transformation=None
-                )
+            # all baseline models are saved in same folder
+            prefix = f"{self.parent_prefix_}{SEP}baselines"
 
-                if fit_on_all_train_data and 'data' in train_data:
-                    model.fit_on_all_training_data(**train_data)
-                else:
-                    # when data is given as x,y, we don't have access to validation data
-                    # it is hoped that validation data is already in x if data was split into 3 sets
-                    model.fit(**train_data)
+            args = (prefix, train_data, test_data, fit_on_all_train_data)
 
-                if test_data:
-                    t, p = model.predict(return_true=True, **test_data)
-                else:
-                    t, p = model.predict(return_true=True)
-
-                errors = self.Metrics(t, p, multiclass=model.is_multiclass)
-                val_scores[model_name] = getattr(errors, self.eval_metric)(**METRICS_KWARGS.get(self.eval_metric, {}))
+            # DL models may have been added by the user with add_dl_model and
+            # can not be found by the worker processes
+            if self.n_jobs != 1 and len(self.models) > 1 and self.category == "ML":
+                with parallel_backend("loky", inner_max_num_threads=1):
+                    model_results = Parallel(n_jobs=min(self.n_jobs, len(self.models)))(
+                        delayed(self._fit_baseline)(model_name, *args) for model_name in self.models
+                    )
+            else:
+                model_results = [self._fit_baseline(model_name, *args) for model_name in self.models]
 
-                _metrics = {}
-                for m in self.monitor:
-                    _metrics[m] = getattr(errors, m)(**METRICS_KWARGS.get(m, {}))
+            for model_name, (val_score, _metrics) in zip(self.models, model_results):
+                val_scores[model_name] = val_score
                 metrics[model_name] = _metrics
 
             results = {
@@ -1357,10 +1957,54 @@ class OptimizePipeline(PipelineMixin):
             with open(os.path.join(self.path, "baselines", "results.json"), 'w') as fp:
                 json.dump(results, fp, sort_keys=True, indent=4)
         else:
-            val_scores, metrics = self.baseline_results_.values()
+            # results were saved with sorted keys, so don't rely on order of values
+            val_scores = self.baseline_results_['val_scores']
+            metrics = self.baseline_results_['metrics']
 
         return val_scores, metrics
 
+    def _fit_baseline(
+            self,
+            model_name: str,
+            prefix: str,
+            train_data: dict,
+            test_data: dict,
+            fit_on_all_train_data: bool
+    ) -> Tuple[float, dict]:
+        """fits the model with default parameters and returns its val_score and
+        metrics being monitored on test data"""
+        model_config = model_name
+        if self.category == "DL":
+            model_config = DL_MODELS[model_name](mode=self.mode, output_features=self.num_outputs)
+
+        # build model. Models fitted in parallel can be built at the same
+        # time, so each model gets its own folder inside prefix
+        model = self._build_model(
+            model=model_config,
+            val_metric=self.eval_metric,
+            prefix=f"{prefix}{SEP}{model_name}",
+            x_transformation=None,
+            y_transformation=None
+        )
+
+        if fit_on_all_train_data and 'data' in train_data:
+            model.fit_on_all_training_data(**train_data)
+        else:
+            # when data is given as x,y, we don't have access to validation data
+            # it is hoped that validation data is already in x if data was split into 3 sets
+            model.fit(**train_data)
+
+        if test_data:
+            t, p = model.predict(return_true=True, **test_data)
+        else:
+            t, p = model.predict(return_true=True)
+
+        errors = self.Metrics(t, p, multiclass=model.is_multiclass)
+        metrics = calc_metrics(errors, self.monitor)
+
+        # evaluation metric is always monitored, so it is not calculated again
+        return metrics[self.eval_metric], metrics
+
     def dumbbell_plot(
             self,
             x = None,
@@ -1442,20 +2086,18 @@ class OptimizePipeline(PipelineMixin):
 
             optimized_models[model_name] = metric_val
 
-        combined = defaultdict(list)
-        for d in (bl_models, optimized_models):
-            for key, value in d.items():
-                combined[key].append(value)
-
-        df = pd.DataFrame.from_dict(combined).transpose()
-        df = df.reset_index()
-        df.columns = ['models', 'baseline', 'optimized']
+        models = list(bl_models.keys())
+        df = pd.DataFrame({
+            'models': models,
+            'baseline': [bl_models[model] for model in models],
+            'optimized': [optimized_models[model] for model in models],
+        })
 
         labels = _shred_suffix(df['models'].tolist())
 
         df.to_csv(os.path.join(self.path, f"dumbell_{metric_name}_data.csv"))
 
-        baseline = np.where(df['baseline']<-1.0, -1.0, df['baseline'])
+        baseline = np.clip(df['baseline'].to_numpy(), -1.0, None)
         fig, ax = plt.subplots(figsize=figsize)
         ax = dumbbell_plot(baseline,
                            df['optimized'],
@@ -1570,9 +2212,10 @@ class OptimizePipeline(PipelineMixin):
 
         # save taylor plot data as csv file, first make a dataframe
         sim = self.taylor_plot_data_['simulations']['test']
-        data = np.column_stack([v.reshape(-1, ) for v in sim.values()])
-        df = pd.DataFrame(data, columns=list(sim.keys()))
-        df['observations'] = self.taylor_plot_data_['observations']['test']
+        columns = list(sim.keys()) + ['observations']
+        data = np.column_stack([np.ravel(v) for v in sim.values()] +
+                               [np.ravel(self.taylor_plot_data_['observations']['test'])])
+        df = pd.DataFrame(data, columns=columns, copy=False)
 
         df.to_csv(os.path.join(self.path, "taylor_data.csv"), index=False)
 
@@ -1606,18 +2249,22 @@ class OptimizePipeline(PipelineMixin):
             json.dump(parent_suggestions, fp, sort_keys=True)
 
         # make a 2d array of all erros being monitored.
-        errors = pd.concat([self.metrics_,
-                            pd.DataFrame(self.val_scores_, columns=['val_scores'])],
-                           axis=1)
+        errors = pd.DataFrame({**self._metrics_arr, 'val_scores': self.val_scores_},
+                              columns=self.monitor + ['val_scores'])
         # save the errors being monitored
         fpath = os.path.join(self.path, "errors.csv")
         errors.to_csv(fpath, index_label="iterations")
 
-        # save results of child iterations as csv file
+        if isinstance(self.child_val_scores_, np.memmap):
+            self.child_val_scores_.flush()
+
+        # save results of child iterations as csv file. The DataFrame is
+        # only a view so the (memory mapped) array is not copied in memory
         fpath = os.path.join(self.path, "child_val_scores.csv")
         pd.DataFrame(
             self.child_val_scores_,
-            columns=[f'child_iter_{i}' for i in range(self.max_child_iters)]).to_csv(fpath)
+            columns=[f'child_iter_{i}' for i in range(self.max_child_iters)],
+            copy=False).to_csv(fpath)
 
         fpath = os.path.join(self.path, 'child_seeds.csv')
         pd.DataFrame(self.child_seeds_, columns=['child_seeds']).to_csv(fpath, index=False)
@@ -1628,15 +2275,17 @@ class OptimizePipeline(PipelineMixin):
 
     def metric_report(self, metric_name: str) -> str:
         """report with respect to one performance metric"""
-        metric_val_ = self.get_best_metric(metric_name)
-        best_model_name = list(self.get_best_pipeline_by_metric(metric_name)['model'].keys())[0]
+        pipeline = self.get_best_pipeline_by_metric(metric_name)
+        iter_num = pipeline['iter_num']
+        metric_val_ = self._metrics_arr[metric_name][iter_num].item()
+        best_model_name = list(pipeline['model'].keys())[0]
 
         rep = f"""
     With respect to {metric_name},
 the best model was {best_model_name} which had 
 '{metric_name}' value of {round(metric_val_, 4)}. This model was obtained at 
-{self.get_best_metric_iteration(metric_name)} iteration and is saved at 
-{self.get_best_pipeline_by_metric(metric_name)['path']}
+{iter_num} iteration and is saved at 
+{pipeline['path']}
         """
         return rep
 
@@ -1698,48 +2347,8 @@ The given parent iterations were {self.parent_iterations} but optimization stopp
     @staticmethod
     def _version_info() -> dict:
         """returns version of the third party libraries used"""
-        import ai4water
-        import SeqMetrics
-        import matplotlib
-        import sklearn
-        import easy_mpl
-        from . import __version__
-        versions = dict()
-        versions['ai4water'] = ai4water.__version__
-        versions['SeqMetrics'] = SeqMetrics.__version__
-        versions['easy_mpl'] = easy_mpl.__version__
-        versions['numpy'] = np.__version__
-        versions['pandas'] = pd.__version__
-        versions['matplotlib'] = matplotlib.__version__
-        versions['sklearn'] = sklearn.__version__
-        versions['python'] = sys.version
-        versions['autotab'] = __version__
-
-        try:
-            import xgboost
-            versions['xgboost'] = xgboost.__version__
-        except (ModuleNotFoundError, ImportError):
-            versions['xgboost'] = None
-
-        try:
-            import catboost
-            versions['catboost'] = catboost.__version__
-        except (ModuleNotFoundError, ImportError):
-            versions['catboost'] = None
-
-        try:
-            import lightgbm
-            versions['lightgbm'] = lightgbm.__version__
-        except (ModuleNotFoundError, ImportError):
-            versions['lightgbm'] = None
-
-        try:
-            import tensorflow
-            versions['tensorflow'] = tensorflow.__version__
-        except (ModuleNotFoundError, ImportError):
-            versions['tensorflow'] = None
-
-        return versions
+        # a copy so that the cached versions are not modified by the caller
+        return dict(_library_versions())
 
     def config(self) -> dict:
         """
@@ -1803,7 +2412,22 @@ The given parent iterations were {self.parent_iterations} but optimization stopp
             # don't put val_scores in metrics_
             cls.val_scores_ = errors.pop('val_scores').values
 
-            cls.metrics_ = errors
+            cls._metrics_arr = {col: errors[col].values for col in errors.columns}
+
+            # values of metrics at those iterations where they improved, in the
+            # same way as they are recorded during optimization
+            cls._metrics_best_arr = {}
+            cls._best_so_far = {}
+            for col, vals in cls._metrics_arr.items():
+                func = compare_func(METRIC_TYPES[col])
+                best_arr = np.full(len(vals), np.nan)
+                best_so_far = np.nan
+                for idx, val in enumerate(vals):
+                    if func(val, fill_val(METRIC_TYPES[col], best_so_far)):
+                        best_arr[idx] = val
+                        best_so_far = val
+                cls._metrics_best_arr[col] = best_arr
+                cls._best_so_far[col] = best_so_far
 
         cls.taylor_plot_data_ = {
                 'simulations': {"test": {}},
@@ -1905,7 +2529,10 @@ The given parent iterations were {self.parent_iterations} but optimization stopp
                              list(pipeline['model'].keys())[0])
         model.update_weights(wpath)
 
-        self._populate_results(model, train_data=train_data, test_data=test_data)
+        # the model was already trained during optimization so
+        # evaluating it on training data is not required
+        self._populate_results(model, train_data=train_data, test_data=test_data,
+                               eval_on_training_data=False)
 
         return model
 
@@ -2106,16 +2733,19 @@ The given parent iterations were {self.parent_iterations} but optimization stopp
             model,
             train_data,
             test_data,
-            model_name=None
+            model_name=None,
+            eval_on_training_data:bool = True,
     ) -> None:
         """evaluates/makes predictions from model on traiing/validation/test data.
         if model_name is given, model's predictions are saved in 'taylor_plot_data_'
-        dictionary
+        dictionary. If eval_on_training_data is False, the model is not evaluated
+        on training data.
         """
-        if 'data' in train_data:
-            model.predict_on_training_data(**train_data, metrics="all")
-        else:
-            model.predict(**train_data, metrics="all")
+        if eval_on_training_data:
+            if 'data' in train_data:
+                model.predict_on_training_data(**train_data, metrics="all")
+            else:
+                model.predict(**train_data, metrics="all")
 
         if test_data:
             t, p = model.predict(**test_data, return_true=True, metrics="all")
@@ -2348,11 +2978,56 @@ The given parent iterations were {self.parent_iterations} but optimization stopp
         if dirs_to_exclude is None:
             dirs_to_exclude = []
 
-        for _item in os.listdir(self.path):
-            _path = os.path.join(self.path, _item)
-            if os.path.isdir(_path):
-                if _item not in ['results_from_scratch'] + dirs_to_exclude:
-                    shutil.rmtree(_path)
+        excluded = frozenset(['results_from_scratch'] + dirs_to_exclude)
+
+        # scandir gets the type of entry without another stat call
+        with os.scandir(self.path) as entries:
+            paths = [entry.path for entry in entries
+                     if entry.is_dir() and entry.name not in excluded]
+
+        # deleting is mostly waiting for file system, so folders are deleted
+        # in threads. list() is used to raise the errors if any.
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            list(executor.map(shutil.rmtree, paths))
+        return
+
+    def __getstate__(self) -> dict:
+        """the pipeline is pickled when its methods are run in worker processes
+        e.g. with ``n_jobs`` or ``child_n_jobs`` greater than 1. The optimizer of
+        a previous fit is not required there and ai4water's HyperOpt can not
+        be unpickled, so it is left out."""
+        state = self.__dict__.copy()
+        state.pop('optimizer_', None)
+        return state
+
+    def __enter__(self) -> "OptimizePipeline":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        """releases the optimizer, the cached results of pipelines and the
+        memory mapped file of child val scores. Nothing is deleted from path,
+        use ``cleanup`` to remove the folders of models.
+
+        Example
+        -------
+            >>> with OptimizePipeline(...) as pl:
+            ...     pl.fit(data=data)
+            ...     pl.post_fit(data=data)
+            >>> pl.cleanup()
+        """
+        child_val_scores = self.__dict__.get('child_val_scores_')
+        if isinstance(child_val_scores, np.memmap):
+            child_val_scores.flush()
+            # an in memory copy so that the file is closed
+            self.child_val_scores_ = np.array(child_val_scores)
+            del child_val_scores
+
+        self.__dict__.pop('optimizer_', None)
+        for cache in ('_parent_cache_', '_child_history', '_best_pipelines'):
+            if cache in self.__dict__:
+                self.__dict__[cache].clear()
+
+        gc.collect()
         return
 
     def compare_models(
@@ -2425,8 +3100,9 @@ The given parent iterations were {self.parent_iterations} but optimization stopp
             self,
             model,
             metric: str,
-            eval_metrics=False) -> float:
-        """evaluates the model"""
+            eval_metrics=False) -> Tuple[float, dict]:
+        """evaluates the model and returns the val_score and a dictionary
+        of performance metrics being monitored"""
         # make prediction on validation data
         if self.val_data_:
             t, p = model.predict(**self.val_data_, return_true=True, process_results=False)
@@ -2439,6 +3115,10 @@ The given parent iterations were {self.parent_iterations} but optimization stopp
         if self.mode=="classification":
             t = np.argmax(t, axis=1)
             p = np.argmax(p, axis=1)
+        else:
+            # contiguous float arrays so that Metrics don't have to convert them
+            t = np.ascontiguousarray(t, dtype=np.float64)
+            p = np.ascontiguousarray(p, dtype=np.float64)
 
         errors = self.Metrics(
             t,
@@ -2447,38 +3127,79 @@ The given parent iterations were {self.parent_iterations} but optimization stopp
             remove_neg=True,
             multiclass=model.is_multiclass)
 
-        val_score = getattr(errors, metric)()
+        metrics = {}
+        if eval_metrics:
+            # calculate all additional performance metrics which are being monitored
+            metrics = calc_metrics(errors, self.monitor)
 
-        metric_type = METRIC_TYPES.get(metric, 'min')
+        # the evaluation metric is monitored by default so don't calculate
+        # it again if it was calculated with same arguments
+        if metric in metrics and not METRICS_KWARGS.get(metric):
+            val_score = metrics[metric]
+        else:
+            val_score = getattr(errors, metric)()
 
         # the optimization will always solve minimization problem so if
         # the metric is to be maximized change the val_score accordingly
-        if metric_type != "min":
-            val_score = 1.0 - val_score
+        if metric == self.eval_metric:
+            offset, sign = self._val_score_transform
+        else:
+            offset, sign = VAL_SCORE_TRANSFORMS[METRIC_TYPES.get(metric, 'min')]
+        val_score = offset + sign * val_score
 
         # val_score can be None/nan/inf
         if not math.isfinite(val_score):
             val_score = 1.0
 
-        if eval_metrics:
-            # calculate all additional performance metrics which are being monitored
-
-            for _metric in self.monitor:
-                pm = getattr(errors, _metric)(**METRICS_KWARGS.get(_metric, {}))
-                #v[self.parent_iter_] = pm
-                self.metrics_.at[self.parent_iter_, _metric] = pm
-
-                func = compare_func1(METRIC_TYPES[_metric])
-                best_so_far = func(self.metrics_best_.loc[:self.parent_iter_, _metric])
-
-                best_so_far = fill_val(METRIC_TYPES[_metric], best_so_far)
-
-                func = compare_func(METRIC_TYPES[_metric])
-                if func(pm, best_so_far):
-
-                    self.metrics_best_.at[self.parent_iter_, _metric] = pm
-
-        return val_score
+        return val_score, metrics
+
+
+@functools.lru_cache(maxsize=None)
+def _library_versions() -> dict:
+    """returns version of the third party libraries used. The versions
+    do not change during a session, so the libraries are imported only once."""
+    import ai4water
+    import SeqMetrics
+    import matplotlib
+    import sklearn
+    import easy_mpl
+    from . import __version__
+    versions = dict()
+    versions['ai4water'] = ai4water.__version__
+    versions['SeqMetrics'] = SeqMetrics.__version__
+    versions['easy_mpl'] = easy_mpl.__version__
+    versions['numpy'] = np.__version__
+    versions['pandas'] = pd.__version__
+    versions['matplotlib'] = matplotlib.__version__
+    versions['sklearn'] = sklearn.__version__
+    versions['python'] = sys.version
+    versions['autotab'] = __version__
+
+    try:
+        import xgboost
+        versions['xgboost'] = xgboost.__version__
+    except (ModuleNotFoundError, ImportError):
+        versions['xgboost'] = None
+
+    try:
+        import catboost
+        versions['catboost'] = catboost.__version__
+    except (ModuleNotFoundError, ImportError):
+        versions['catboost'] = None
+
+    try:
+        import lightgbm
+        versions['lightgbm'] = lightgbm.__version__
+    except (ModuleNotFoundError, ImportError):
+        versions['lightgbm'] = None
+
+    try:
+        import tensorflow
+        versions['tensorflow'] = tensorflow.__version__
+    except (ModuleNotFoundError, ImportError):
+        versions['tensorflow'] = None
+
+    return versions
 
 
 def verify_data(
@@ -2530,18 +3251,23 @@ def verify_data(
     return train_data, val_data
 
 
-def _shred_suffix(labels:list)->list:
+def _is_reusable(estimator, suggestions:dict) -> bool:
+    """whether the estimator can be reused for other suggestions by only
+    setting its parameters. This is true only for scikit-learn estimators
+    which received the suggestions unchanged. For others e.g. lightgbm,
+    ai4water may adjust or add parameters while building the estimator
+    depending upon the suggestions, which set_params would skip."""
+    if not type(estimator).__module__.startswith("sklearn.") or not hasattr(estimator, 'set_params'):
+        return False
 
-    new_labels = []
+    params = estimator.get_params()
+    return all(k in params and params[k] == v for k, v in suggestions.items())
 
-    for label in labels:
-        if label.endswith('Regressor'):
-            label = label.replace('Regressor', '')
-        elif label.endswith('Classifier'):
-            label = label.replace('Classifier', '')
-        new_labels.append(label)
 
-    return new_labels
+def _shred_suffix(labels:list)->list:
+    """removes 'Regressor' or 'Classifier' from the end of labels"""
+    return pd.Series(labels, dtype=str).str.replace(
+        r'(Regressor|Classifier)$', '', regex=True).tolist()
 
 
 class MetricNotMonitored(Exception):
@@ -2557,6 +3283,11 @@ class MetricNotMonitored(Exception):
         """
 
 
+class ChildEarlyStop(Exception):
+    """raised inside child objective function to stop the child hpo loop"""
+    pass
+
+
 class ModelNotUsedError(Exception):
 
     def __init__(self, model_name):
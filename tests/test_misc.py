@@ -4,6 +4,11 @@ warnings.warn = warn
 
 import os
 import unittest
+from unittest import mock
+from collections import defaultdict
+
+import numpy as np
+from skopt import Optimizer
 
 from autotab import OptimizePipeline
 from ai4water.preprocessing import DataSet
@@ -14,11 +19,75 @@ ds = DataSet(rgr_data, verbosity=0)
 train_x, train_y = ds.training_data()
 val_x, val_y = ds.validation_data()
 test_x, test_y = ds.test_data()
+train_x_features = rgr_data.columns.tolist()[0:-1]
+
+
+def record_fitted_inputs(pl):
+    """makes the estimators of all models built by pl record the inputs
+    they are fitted on. Returns a dictionary whose keys are prefixes of
+    models and values are lists of (x_transformation, x) pairs"""
+    fitted = defaultdict(list)
+    build_model = pl._build_model
+
+    def _build_model(*args, **kwargs):
+        model = build_model(*args, **kwargs)
+        estimator_fit = model._model.fit
+
+        def fit(x, *fit_args, **fit_kwargs):
+            fitted[kwargs['prefix']].append((kwargs['x_transformation'], np.array(x)))
+            return estimator_fit(x, *fit_args, **fit_kwargs)
+
+        model._model.fit = fit
+        return model
+
+    pl._build_model = _build_model
+    return fitted
+
 
 class TestMisc(unittest.TestCase):
 
     show = False
 
+    def _check_child_inputs(self, fitted):
+        # child models and the model of their parent iteration share the prefix
+        # and all of them must be fitted on same transformed inputs
+        num_checked = 0
+        for prefix, fits in fitted.items():
+            assert len(fits) > 1, prefix
+            parent_x = fits[-1][1]
+            for x_transformation, x in fits:
+                np.testing.assert_allclose(x, parent_x)
+
+                for t in x_transformation or []:
+                    for feature in t['features']:
+                        col = x[:, train_x_features.index(feature)]
+                        self.assertAlmostEqual(col.mean(), 0.0, places=5)
+                        num_checked += 1
+        assert num_checked > 0
+        return
+
+    def test_child_transformed_inputs(self):
+        """child models are fitted on inputs transformed by x_transformations"""
+        pl = build_basic(models=['Lasso'],
+                         parent_iterations=3,
+                         child_iterations=3,
+                         input_transformations=['zscore'])
+        fitted = record_fitted_inputs(pl)
+        pl.fit(data=rgr_data, process_results=False)
+        self._check_child_inputs(fitted)
+        return
+
+    def test_child_transformed_inputs_xy(self):
+        """child models are fitted on transformed inputs when x, y are given"""
+        pl = build_basic(models=['Lasso'],
+                         parent_iterations=3,
+                         child_iterations=3,
+                         input_transformations=['zscore'])
+        fitted = record_fitted_inputs(pl)
+        pl.fit(x=train_x, y=train_y, validation_data=(val_x, val_y), process_results=False)
+        self._check_child_inputs(fitted)
+        return
+
     def test_r2_as_val_metric(self):
         """test a specifc val metric"""
         run_basic(eval_metric="r2",
@@ -48,6 +117,10 @@ class TestMisc(unittest.TestCase):
         )
 
         pl2 = OptimizePipeline.from_config_file(os.path.join(pl.path, "config.json"))
+        np.testing.assert_allclose(pl2.metrics_best_.values, pl.metrics_best_.values)
+        for metric in pl.monitor:
+            assert pl2.get_best_metric_iteration(metric) == pl.get_best_metric_iteration(metric)
+            np.testing.assert_allclose(pl2.get_best_metric(metric), pl.get_best_metric(metric))
         pl2.post_fit(data=rgr_data, show=self.show)
         return
 
@@ -68,6 +141,36 @@ class TestMisc(unittest.TestCase):
                           models=['Lasso', 'LassoLars', 'LassoCV', 'Lasso'])
         return
 
+    def test_n_jobs(self):
+        """n_jobs and child_n_jobs must be non-zero integers"""
+        self.assertRaises(ValueError, build_basic, n_jobs=0, parent_algorithm="bayes")
+        self.assertRaises(ValueError, build_basic, child_n_jobs=0)
+        self.assertRaises(ValueError, build_basic, n_jobs=2.5)
+        pl = build_basic(n_jobs=-1, child_n_jobs=-1, parent_algorithm="bayes")
+        assert pl.n_jobs == os.cpu_count()
+        assert pl.child_n_jobs == os.cpu_count()
+
+        pl = build_basic(n_jobs=2, parent_algorithm="bayes")
+        self.assertRaises(ValueError, pl.fit, data=rgr_data, previous_results={})
+        return
+
+    def test_parallel_reproducible(self):
+        """with n_jobs>1 the parent suggestions are reproducible"""
+        suggestions = []
+        for _ in range(2):
+            np.random.seed(313)
+            pl = run_basic(parent_algorithm="bayes",
+                           child_iterations=0,
+                           n_jobs=2,
+                           process_results=False)
+            suggestions.append([pl.parent_suggestions_[i] for i in range(pl.parent_iterations)])
+            pl.cleanup()
+        for first, second in zip(*suggestions):
+            first, second = dict(first), dict(second)
+            first.pop('path'), second.pop('path')
+            assert first == second
+        return
+
     def test_zero_child_iter(self):
         pl = run_basic(parent_iterations=4,
                        child_iterations=0,
@@ -88,6 +191,171 @@ class TestMisc(unittest.TestCase):
         assert pl.child_val_scores_.size == 0
         return
 
+    def test_child_patience(self):
+        """child hpo loop stops if val_score does not improve"""
+        pl = build_basic(models=['RandomForestRegressor'],
+                         parent_iterations=4,
+                         child_iterations=15,
+                         child_patience=2)
+        # all child iterations get same val_score, so it can not improve
+        with mock.patch.object(pl, '_child_val_score', return_value=1.0) as child_val_score:
+            pl.fit(data=rgr_data, process_results=False)
+
+        assert pl.child_val_scores_.shape[1] == 15
+
+        paths = set()
+        for iter_num, pipeline in pl.parent_suggestions_.items():
+            # cached pipelines are not optimized again
+            if pipeline['path'] in paths:
+                continue
+            paths.add(pipeline['path'])
+            # first iteration sets the best val_score and then it does not
+            # improve for child_patience iterations
+            scores = pl.child_val_scores_[iter_num]
+            assert np.isfinite(scores[:3]).all(), scores
+            assert np.isnan(scores[3:]).all(), scores
+
+        assert child_val_score.call_count == 3 * len(paths)
+        return
+
+    def test_child_nan_val_scores(self):
+        """first suggestion is used when no child iteration has a finite val_score"""
+        pl = build_basic(models=['RandomForestRegressor'],
+                         parent_iterations=2,
+                         child_iterations=3)
+        with mock.patch.object(pl, '_child_val_score', return_value=np.nan):
+            pl.fit(data=rgr_data, process_results=False)
+
+        for pipeline in pl.parent_suggestions_.values():
+            assert len(pipeline['model']['RandomForestRegressor']) > 0
+        return
+
+    def test_parallel_child_hpo(self):
+        """child iterations with random search are evaluated in parallel"""
+        pl = run_basic(models=['RandomForestRegressor'],
+                       parent_iterations=2,
+                       child_iterations=6,
+                       child_algorithm="random",
+                       child_n_jobs=2,
+                       process_results=False)
+        assert pl.child_val_scores_.shape == (2, 6)
+        assert np.isfinite(pl.child_val_scores_[0]).all()
+
+        # same points are evaluated with same seeds irrespective of child_n_jobs
+        child_space = pl.model_space['RandomForestRegressor']['param_space']
+        results = {}
+        for child_n_jobs in [1, 2]:
+            pl.child_n_jobs = child_n_jobs
+            scores = []
+            paras = pl._parallel_child_search(
+                "RandomForestRegressor", child_space, None, None,
+                prefix=os.path.join(pl.parent_prefix_, f"n_jobs_{child_n_jobs}"),
+                child_scores=scores,
+                random_state=pl._child_random_state(0))
+            results[child_n_jobs] = (paras, scores)
+
+        assert len(results[1][1]) == 6
+        assert results[1][0] == results[2][0]
+        np.testing.assert_allclose(results[1][1], results[2][1])
+        pl.cleanup()
+        return
+
+    def test_parallel_refit(self):
+        """a fitted pipeline can be fitted again with parallel child hpo"""
+        pl = run_basic(models=['RandomForestRegressor'],
+                       parent_iterations=2,
+                       child_iterations=4,
+                       process_results=False)
+        assert hasattr(pl, 'optimizer_')
+        pl.child_n_jobs = 2
+        pl.fit(data=rgr_data, process_results=False)
+        assert np.isfinite(pl.child_val_scores_[0]).all()
+        pl.cleanup()
+        return
+
+    def test_parallel_bayes_child_hpo(self):
+        """child iterations with bayes are suggested and evaluated in batches"""
+        with mock.patch.object(Optimizer, 'tell', autospec=True,
+                               side_effect=Optimizer.tell) as tell:
+            pl = run_basic(models=['RandomForestRegressor'],
+                           parent_iterations=2,
+                           child_iterations=20,
+                           child_algorithm="bayes",
+                           child_n_jobs=3,
+                           process_results=False)
+
+        assert pl._child_algorithm('RandomForestRegressor') == "bayes"
+        assert pl.child_val_scores_.shape == (2, 20)
+        assert np.isfinite(pl.child_val_scores_[0]).all()
+
+        # all the points of first parent iteration are told in batches of 3,
+        # while previous results are told at once before second parent iteration.
+        # Optimizers which tell one point at a time are not of child hpo
+        told = [len(call.args[2]) for call in tell.call_args_list
+                if isinstance(call.args[2], list)]
+        assert sum(told[:7]) == 20, told
+        assert max(told[:7]) == 3, told
+        pl.cleanup()
+        return
+
+    def test_reused_child_model(self):
+        """a child model reused with other parameters predicts the same as a newly built one"""
+        pl = run_basic(parent_iterations=2,
+                       child_iterations=0,
+                       process_results=False)
+        kwargs = dict(lr=0.001, batch_size=32, x_transformations=None,
+                      y_transformations=None, seed=313)
+        model_shell = {}
+        pl._child_val_score("RandomForestRegressor", {"n_estimators": 10, "max_depth": 3},
+                            prefix=os.path.join(pl.parent_prefix_, "reused"),
+                            model_shell=model_shell, **kwargs)
+        assert 'model' in model_shell
+        reused_model = model_shell['model']
+
+        suggestions = {"n_estimators": 20, "max_depth": 5}
+        reused_score = pl._child_val_score("RandomForestRegressor", suggestions,
+                                           prefix=os.path.join(pl.parent_prefix_, "reused"),
+                                           model_shell=model_shell, **kwargs)
+        assert model_shell['model'] is reused_model
+        rebuilt_score = pl._child_val_score("RandomForestRegressor", suggestions,
+                                            prefix=os.path.join(pl.parent_prefix_, "rebuilt"),
+                                            **kwargs)
+        self.assertAlmostEqual(reused_score, rebuilt_score)
+
+        rebuilt_model = pl._build_model(
+            model={"RandomForestRegressor": suggestions},
+            val_metric=pl.eval_metric,
+            x_transformation=None,
+            y_transformation=None,
+            prefix=os.path.join(pl.parent_prefix_, "rebuilt"))
+        rebuilt_model.seed_everything(313)
+        rebuilt_model.fit(**pl.data_)
+
+        _, reused_p = reused_model.predict_on_validation_data(
+            **pl.data_, return_true=True, process_results=False)
+        _, rebuilt_p = rebuilt_model.predict_on_validation_data(
+            **pl.data_, return_true=True, process_results=False)
+        np.testing.assert_allclose(reused_p, rebuilt_p)
+        pl.cleanup()
+        return
+
+    def test_context_manager(self):
+        """optimizer and memory mapped child val scores are released when the block is exited"""
+        with build_basic(parent_iterations=4, child_iterations=2) as pl:
+            pl.fit(data=rgr_data, process_results=False)
+            assert hasattr(pl, 'optimizer_')
+            assert isinstance(pl.child_val_scores_, np.memmap)
+            model_dirs = [entry for entry in os.scandir(pl.path) if entry.is_dir()]
+        assert not hasattr(pl, 'optimizer_')
+        assert not isinstance(pl.child_val_scores_, np.memmap)
+        assert pl.child_val_scores_.shape == (4, 2)
+        # nothing is deleted from path
+        assert os.path.exists(os.path.join(pl.path, "errors.csv"))
+        for entry in model_dirs:
+            assert os.path.isdir(entry.path)
+        pl.cleanup()
+        return
+
     def test_grouped_transformations(self):
         pl = run_basic(
             inputs_to_transform={
@@ -12,6 +12,7 @@ def warn(*args, **kwargs):
 
 warnings.warn = warn
 
+import numpy as np
 import matplotlib.pyplot as plt
 from ai4water.preprocessing import DataSet
 
@@ -49,6 +50,28 @@ class TestRegression(unittest.TestCase):
         pl.cleanup()
         return
 
+    def test_best_pipeline_by_model(self):
+        """best pipeline of a model is found by maximizing r2 and minimizing rmse"""
+        pl = run_basic(parent_iterations=8,
+                       child_iterations=0,
+                       monitor=['r2', 'rmse'],
+                       process_results=False)
+
+        for model in pl.models:
+            iters = [i for i, pipeline in pl.parent_suggestions_.items()
+                     if model in pipeline['model']]
+            if len(iters) == 0:
+                continue
+
+            best_r2, _ = pl.get_best_pipeline_by_model(model, 'r2')
+            assert best_r2 == round(float(np.nanmax(pl.metrics_['r2'].values[iters])), 4)
+
+            best_rmse, best_pl = pl.get_best_pipeline_by_model(model, 'rmse')
+            assert best_rmse == round(float(np.nanmin(pl.metrics_['rmse'].values[iters])), 4)
+            assert model in best_pl['model']
+        pl.cleanup()
+        return
+
     def test_basic_with_xy(self):
 
         pl = build_basic()
@@ -68,6 +91,46 @@ class TestRegression(unittest.TestCase):
         pl.cleanup()
         return
 
+    def test_single_child_iter(self):
+        """check that a model with only one child iteration is optimized without an optimizer"""
+        pl = build_basic(models = ['RandomForestRegressor'])
+        pl.change_child_iteration({"RandomForestRegressor": 1})
+        pl.fit(data=rgr_data, process_results=False)
+
+        space = {dim.name: dim for dim in pl.model_space['RandomForestRegressor']['param_space']}
+        paths = set()
+        for iter_num, pipeline in pl.parent_suggestions_.items():
+            num_scores = np.count_nonzero(~np.isnan(pl.child_val_scores_[iter_num]))
+            # cached pipelines are not optimized again
+            if pipeline['path'] in paths:
+                assert num_scores == 0
+                continue
+            paths.add(pipeline['path'])
+            assert num_scores == 1
+
+            paras = pipeline['model']['RandomForestRegressor']
+            assert len(paras) > 0
+            for para, val in paras.items():
+                assert val in space[para], f"{para}: {val}"
+
+        # each parent iteration samples different parameters
+        assert pl.parent_suggestions_[0]['model'] != pl.parent_suggestions_[1]['model']
+        pl.cleanup()
+        return
+
+    def test_change_child_algorithm(self):
+        """check that we can change the child hpo algorithm for a model"""
+        pl = build_basic(models = ['Lasso', 'RandomForestRegressor'],
+                         child_algorithm="bayes")
+        # small number of child iterations, so random search is used
+        assert pl._child_algorithm("RandomForestRegressor") == "random"
+        pl.change_child_algorithm({"RandomForestRegressor": "bayes"})
+        assert pl._child_algorithm("RandomForestRegressor") == "bayes"
+        pl.change_child_iteration({"RandomForestRegressor": 12})
+        pl.fit(data=rgr_data, process_results=False)
+        pl.cleanup()
+        return
+
     def test_remove_model(self):
         """test that we can remove a model which is already being considered"""
         pl = build_basic()
@@ -162,6 +225,20 @@ class TestRegression(unittest.TestCase):
 
         return
 
+    def test_parallel_parent_hpo(self):
+        """parent iterations are evaluated in parallel"""
+        pl = run_basic(parent_algorithm="bayes",
+                       parent_iterations=12,
+                       child_iterations=2,
+                       n_jobs=3,
+                       process_results=False)
+        assert pl.parent_iter_ == 12
+        assert len(pl.parent_suggestions_) == 12
+        assert not pl.metrics_.isna().any().any()
+        pl.post_fit(data=rgr_data, show=self.show)
+        pl.cleanup()
+        return
+
     def test_single_model(self):
         pl = run_basic(models=["Lasso"],
                        process_results=False)